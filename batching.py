@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import (Any, Awaitable, Callable, Generic, List, Optional, Set,
+                    Tuple, TypeVar)
+
+# Configure logging for the batching module
+logger = logging.getLogger(__name__)
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+
+class MicroBatcher(Generic[ItemT, ResultT]):
+    """
+    Collect concurrent submissions and hand them to a handler as one batch.
+
+    A batch is dispatched when it reaches max_batch items or max_wait seconds
+    after its first item arrived, whichever comes first. The handler returns
+    one result per item, in order, and each submitter receives its own result.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[ItemT]], Awaitable[List[ResultT]]],
+        max_batch: int,
+        max_wait: float,
+    ):
+        """
+        Initialize the batcher.
+
+        Args:
+            handler (Callable[[List[ItemT]], Awaitable[List[ResultT]]]): Coroutine
+                function that processes a batch and returns one result per item.
+            max_batch (int): Maximum number of items dispatched together.
+            max_wait (float): Seconds to wait for more items before dispatching.
+        """
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        # Items waiting for the next dispatch, with the futures of their callers
+        self._pending: List[Tuple[ItemT, "asyncio.Future[ResultT]"]] = []
+
+        # Timer that dispatches the pending items once the wait window closes
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # Dispatches in progress, kept so they are not garbage collected
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    async def submit(self, item: ItemT) -> ResultT:
+        """
+        Add an item to the next batch and wait for its result.
+
+        Args:
+            item (ItemT): The item to process.
+
+        Returns:
+            ResultT: The handler's result for this item.
+
+        Raises:
+            Exception: Any exception raised by the handler for the batch.
+        """
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[ResultT]" = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """
+        Dispatch the pending items as one batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(
+        self, batch: List[Tuple[ItemT, "asyncio.Future[ResultT]"]]
+    ) -> None:
+        """
+        Run the handler on a batch and deliver each result to its caller.
+
+        Args:
+            batch (List[Tuple[ItemT, asyncio.Future[ResultT]]]): The items and
+                the futures of the callers waiting on them.
+        """
+        try:
+            results: List[Any] = await self.handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"Batch handler returned {len(results)} results for {len(batch)} items"
+                )
+        except Exception as e:
+            logger.error("Error processing batch of %s items: %s", len(batch), str(e))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # Callers that gave up while waiting have cancelled their future
+            if not future.done():
+                future.set_result(result)
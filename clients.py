@@ -0,0 +1,88 @@
+import logging
+import os
+from typing import Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+# Configure logging for the clients module
+logger = logging.getLogger(__name__)
+
+# Shared connection pool for every outbound API call made by the application
+_http_client: Optional[httpx.AsyncClient] = None
+
+# OpenAI clients keyed by API key, all sharing the connection pool
+_openai_clients: Dict[Optional[str], AsyncOpenAI] = {}
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the shared HTTP client, creating it on first use.
+
+    Reusing one tuned connection pool lets concurrent requests share keep-alive
+    HTTP/2 connections instead of paying TCP and TLS setup on each call.
+    The pool size is read from HTTP_MAX_CONNECTIONS, defaulting to 200, with
+    half of the connections kept alive when idle.
+
+    Returns:
+        httpx.AsyncClient: The shared HTTP client.
+    """
+    global _http_client
+
+    if _http_client is None or _http_client.is_closed:
+        max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections // 2,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            http2=True,
+        )
+        logger.info("Created shared HTTP client")
+
+    return _http_client
+
+
+def get_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """
+    Get the shared OpenAI client for an API key, creating it on first use.
+
+    Args:
+        api_key (Optional[str], optional): The OpenAI API key. Defaults to the
+            OPENAI_API_KEY environment variable.
+
+    Returns:
+        AsyncOpenAI: An OpenAI client backed by the shared HTTP client.
+
+    Raises:
+        ValueError: If no API key is given and OPENAI_API_KEY is not set.
+    """
+    # The environment is only read the first time the default client is needed
+    client = _openai_clients.get(api_key)
+    if client is None:
+        resolved_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY")
+        if not resolved_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+        client = AsyncOpenAI(api_key=resolved_key, http_client=get_http_client())
+        _openai_clients[api_key] = client
+
+    return client
+
+
+async def close_clients() -> None:
+    """
+    Close the shared HTTP client and forget the OpenAI clients using it.
+
+    Intended to be called once when the application shuts down.
+    """
+    global _http_client
+
+    _openai_clients.clear()
+
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Closed shared HTTP client")
@@ -1,19 +1,30 @@
-import json
+import asyncio
+import hashlib
 import logging
 import os
+import tempfile
 import uuid
-from typing import Any, Dict, List, Optional
+import weakref
+from contextlib import asynccontextmanager
+from typing import (Any, AsyncGenerator, AsyncIterable, Dict, List, Optional,
+                    Tuple)
 
+import orjson
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import (BackgroundTasks, FastAPI, File, Form, HTTPException,
                      UploadFile, WebSocket, WebSocketDisconnect)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.types import Receive, Scope, Send
 
 from agent import OpenAIAgent
+from clients import close_clients
+from middleware import SelectiveGZipMiddleware
 from models import ChatMessage, ChatRequest, DocumentResponse
-from utils import get_file_extension, process_file
+from utils import (SUPPORTED_EXTENSIONS, get_file_extension, process_file,
+                   shutdown_pdf_pool)
 from vector_store import VectorStore
 
 # Load environment variables from .env file
@@ -23,8 +34,51 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize FastAPI application with metadata
-app = FastAPI(title="OpenAI Agent API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    """
+    Prepare the application before it serves requests and clean up after it
+    stops.
+
+    On startup, connects to the ingestion queue if one is configured and
+    creates the commonly used assistants before the first request arrives.
+    On shutdown, deletes the cached assistants and closes the vector store
+    database, the shared HTTP connection pool, PDF parsing pool and ingestion
+    queue connection.
+    """
+    global task_queue, vector_store_watcher
+
+    if redis_url:
+        from arq import create_pool
+        from arq.connections import RedisSettings
+
+        task_queue = await create_pool(RedisSettings.from_dsn(redis_url))
+        vector_store_watcher = asyncio.ensure_future(watch_vector_store())
+        logger.info("Queuing uploads for the ingestion worker")
+
+    await agent.warm()
+
+    yield
+
+    if vector_store_watcher is not None:
+        vector_store_watcher.cancel()
+    if task_queue is not None:
+        await task_queue.close()
+
+    vector_store.close()
+
+    # Delete this process's assistants while the client is still open
+    await agent.assistant_cache.aclose()
+
+    await close_clients()
+    shutdown_pdf_pool()
+
+
+# Initialize FastAPI application with metadata, serializing responses with orjson
+app = FastAPI(
+    title="OpenAI Agent API", default_response_class=ORJSONResponse, lifespan=lifespan
+)
 
 # Configure Cross-Origin Resource Sharing (CORS)
 # This allows the API to be accessed from different domains
@@ -37,30 +91,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses such as document listings, leaving the streamed
+# chat endpoint uncompressed so its chunks reach the client immediately
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    excluded_paths=["/stream-chat"],
+    minimum_size=1024,
+    compresslevel=5,
+)
+
 # Initialize vector store for document storage and retrieval
 vector_store: VectorStore = VectorStore()
 
 # Initialize OpenAI agent with the vector store
 agent: OpenAIAgent = OpenAIAgent(vector_store)
 
-# Dictionary to store active WebSocket connections
+# Uploads are copied to disk in pieces of this many bytes
+UPLOAD_CHUNK_SIZE: int = 1 << 20
+
+# When REDIS_URL is set, uploads are queued for the ingestion worker in
+# worker.py instead of being processed by this process
+redis_url: Optional[str] = os.getenv("REDIS_URL")
+task_queue: Optional[Any] = None
+
+# Seconds between checks for documents the ingestion worker has added
+VECTOR_STORE_RELOAD_INTERVAL: float = 2.0
+vector_store_watcher: Optional["asyncio.Task[None]"] = None
+
+# Streamed chunks are coalesced until they reach this many characters or this
+# many milliseconds have passed since the first one, so clients receive fewer,
+# larger frames
+stream_flush_chars: int = int(os.getenv("STREAM_FLUSH_CHARS", "512"))
+stream_flush_seconds: float = float(os.getenv("STREAM_FLUSH_MS", "20")) / 1000
+
+# Registry of active WebSocket connections
 # Key: client_id, Value: WebSocket connection
-active_connections: Dict[str, WebSocket] = {}
+# Values are held weakly, so a connection whose handler never reached its
+# cleanup is still released once nothing else references it
+active_connections: "weakref.WeakValueDictionary[str, WebSocket]" = (
+    weakref.WeakValueDictionary()
+)
 
 
-@app.get("/")
-async def root() -> Dict[str, str]:
+async def coalesce_chunks(chunks: AsyncIterable[str]) -> AsyncGenerator[str, None]:
+    """
+    Merge streamed chunks into larger ones without holding text back for long.
+
+    A merged chunk is emitted once it reaches stream_flush_chars characters or
+    stream_flush_seconds after its first piece arrived, even if no further
+    chunk has arrived by then.
+
+    Args:
+        chunks (AsyncIterable[str]): The chunks to merge.
+
+    Yields:
+        str: The merged chunks, in order.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer: List[str] = []
+    buffered_chars = 0
+    flush_at = 0.0
+    next_chunk: asyncio.Future = asyncio.ensure_future(iterator.__anext__())
+
+    try:
+        while True:
+            # Only wait past the flush deadline when nothing is buffered
+            timeout = max(flush_at - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+
+            if done:
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+
+                if not buffer:
+                    flush_at = loop.time() + stream_flush_seconds
+                buffer.append(chunk)
+                buffered_chars += len(chunk)
+                if buffered_chars < stream_flush_chars and loop.time() < flush_at:
+                    continue
+
+            yield "".join(buffer)
+            buffer.clear()
+            buffered_chars = 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        next_chunk.cancel()
+
+
+async def watch_vector_store() -> None:
+    """
+    Reload the vector store metadata whenever the ingestion worker saves it.
+    """
+    while True:
+        await asyncio.sleep(VECTOR_STORE_RELOAD_INTERVAL)
+        try:
+            vector_store.reload_if_changed()
+        except Exception as e:
+            logger.error(f"Error reloading vector store metadata: {str(e)}")
+
+
+async def sse_events(chunks: AsyncIterable[str]) -> AsyncGenerator[bytes, None]:
+    """
+    Frame streamed text as Server-Sent Events.
+
+    Each chunk becomes one event. Every line of the chunk is sent as its own
+    data field, so clients rejoin the lines with newlines.
+
+    Args:
+        chunks (AsyncIterable[str]): The text chunks to send.
+
+    Yields:
+        bytes: One encoded event per chunk.
+    """
+    async for chunk in chunks:
+        event = "".join(f"data: {line}\n" for line in chunk.split("\n")) + "\n"
+        yield event.encode("utf-8")
+
+
+class HealthCheck:
     """
     Root endpoint to verify API is running.
 
-    Returns:
-        Dict[str, str]: A simple message indicating the API is operational.
+    A plain ASGI app with a pre-serialized body, so load balancer polls skip
+    FastAPI's request handling and response serialization entirely.
     """
-    return {"message": "OpenAI Agent API is running"}
+
+    body: bytes = orjson.dumps({"message": "OpenAI Agent API is running"})
+    headers: List[Tuple[bytes, bytes]] = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": self.headers}
+        )
+        await send({"type": "http.response.body", "body": self.body})
+
+
+# Match the health check before any other route
+app.router.routes.insert(0, Route("/", HealthCheck(), methods=["GET"]))
 
 
 @app.post("/chat", response_model=ChatMessage)
-async def chat(request: ChatRequest) -> ChatMessage:
+async def chat(request: ChatRequest) -> ORJSONResponse:
     """
     Process a chat message and get a response from the OpenAI agent.
 
@@ -68,7 +248,8 @@ async def chat(request: ChatRequest) -> ChatMessage:
         request (ChatRequest): The chat request containing messages and search preferences.
 
     Returns:
-        ChatMessage: The response from the assistant.
+        ORJSONResponse: The response from the assistant as a ChatMessage. It is
+            returned directly, so FastAPI does not validate it a second time.
 
     Raises:
         HTTPException: If there's an error generating the response.
@@ -77,7 +258,7 @@ async def chat(request: ChatRequest) -> ChatMessage:
         response: str = await agent.generate_response(
             request.messages, request.search_web
         )
-        return {"role": "assistant", "content": response}
+        return ORJSONResponse({"role": "assistant", "content": response})
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -99,31 +280,34 @@ async def websocket_chat(websocket: WebSocket, client_id: str) -> None:
 
     try:
         while True:
-            # Receive message from client
+            # Receive message from client, parsing and validating it in one step
             data: str = await websocket.receive_text()
-            request_data: Dict[str, Any] = json.loads(data)
+            request: ChatRequest = ChatRequest.model_validate_json(data)
 
-            messages: List[Dict[str, str]] = request_data.get("messages", [])
-            search_web: bool = request_data.get("search_web", False)
-
-            # Stream response chunks to the client
-            async for chunk in agent.generate_streaming_response(messages, search_web):
+            # Stream response chunks to the client. Frames stay text frames so
+            # browser clients can pass event.data straight to JSON.parse.
+            async for chunk in coalesce_chunks(
+                agent.generate_streaming_response(request.messages, request.search_web)
+            ):
                 await websocket.send_text(
-                    json.dumps({"type": "chunk", "content": chunk})
+                    orjson.dumps({"type": "chunk", "content": chunk}).decode()
                 )
 
             # Signal end of response
-            await websocket.send_text(json.dumps({"type": "end"}))
+            await websocket.send_text(orjson.dumps({"type": "end"}).decode())
 
     except WebSocketDisconnect:
         logger.info(f"Client {client_id} disconnected")
     except Exception as e:
         logger.error(f"Error in WebSocket: {str(e)}")
-        await websocket.send_text(json.dumps({"type": "error", "content": str(e)}))
+        await websocket.send_text(
+            orjson.dumps({"type": "error", "content": str(e)}).decode()
+        )
     finally:
-        # Clean up connection when done
-        if client_id in active_connections:
-            del active_connections[client_id]
+        # Clean up connection when done, unless a reconnect with the same
+        # client_id has already replaced it
+        if active_connections.get(client_id) is websocket:
+            active_connections.pop(client_id, None)
 
 
 @app.post("/stream-chat")
@@ -138,15 +322,23 @@ async def stream_chat(request: ChatRequest) -> StreamingResponse:
         request (ChatRequest): The chat request containing messages and search preferences.
 
     Returns:
-        StreamingResponse: A streaming HTTP response with the generated content.
+        StreamingResponse: A stream of Server-Sent Events with the generated content.
 
     Raises:
         HTTPException: If there's an error generating the streaming response.
     """
     try:
         return StreamingResponse(
-            agent.generate_streaming_response(request.messages, request.search_web),
+            sse_events(
+                coalesce_chunks(
+                    agent.generate_streaming_response(
+                        request.messages, request.search_web
+                    )
+                )
+            ),
             media_type="text/event-stream",
+            # Ask proxies and caches to pass each event through immediately
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
     except Exception as e:
         logger.error(f"Error generating streaming response: {str(e)}")
@@ -163,7 +355,8 @@ async def upload_document(
     """
     Upload a document to the vector store for later retrieval and processing.
 
-    Processes the document in the background to avoid blocking the request.
+    Processes the document in the background to avoid blocking the request,
+    or queues it for the ingestion worker when REDIS_URL is set.
 
     Args:
         background_tasks (BackgroundTasks): FastAPI background tasks handler.
@@ -184,30 +377,70 @@ async def upload_document(
 
         # Validate file extension
         file_extension: str = get_file_extension(file.filename)
-        supported_extensions: List[str] = [".pdf", ".txt", ".md", ".csv", ".json"]
 
-        if file_extension not in supported_extensions:
+        if file_extension not in SUPPORTED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"Unsupported file type. Supported types: {', '.join(supported_extensions)}",
+                detail=f"Unsupported file type. Supported types: {', '.join(sorted(SUPPORTED_EXTENSIONS))}",
             )
 
-        # Process file in the background to avoid blocking the request
-        file_content: bytes = await file.read()
-        background_tasks.add_task(
-            process_file,
-            file_content,
-            file.filename,
-            document_id,
-            json.loads(metadata),
-            vector_store,
-        )
+        # Parse the metadata before anything is written to disk
+        try:
+            document_metadata: Dict[str, Any] = orjson.loads(metadata or "{}")
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Metadata is not valid JSON")
+        if not isinstance(document_metadata, dict):
+            raise HTTPException(
+                status_code=400, detail="Metadata must be a JSON object"
+            )
+
+        # Copy the upload to a temporary file piece by piece so it is never held
+        # in memory whole; process_file deletes the file when it is done.
+        # Hashing along the way lets re-uploads of stored content be skipped
+        content_hash = hashlib.sha256()
+        spool = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
+        try:
+            with spool:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    content_hash.update(chunk)
+                    spool.write(chunk)
+
+            if task_queue is not None:
+                # Hand the file to the ingestion worker so processing does not
+                # compete with requests for this process
+                await task_queue.enqueue_job(
+                    "ingest",
+                    spool.name,
+                    file.filename,
+                    document_id,
+                    document_metadata,
+                    content_hash.hexdigest(),
+                )
+                status = "queued"
+            else:
+                # Process file in the background to avoid blocking the request
+                background_tasks.add_task(
+                    process_file,
+                    spool.name,
+                    file.filename,
+                    document_id,
+                    document_metadata,
+                    vector_store,
+                    content_hash.hexdigest(),
+                )
+                status = "processing"
+        except BaseException:
+            # Nothing will process the file, so remove it now
+            os.unlink(spool.name)
+            raise
 
         return {
             "document_id": document_id,
             "filename": file.filename,
-            "status": "processing",
+            "status": status,
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -247,6 +480,8 @@ async def delete_document(document_id: str) -> Dict[str, str]:
         HTTPException: If the document is not found or there's an error deleting it.
     """
     try:
+        # Include documents the ingestion worker added since the last check
+        vector_store.reload_if_changed()
         success: bool = await vector_store.delete_document(document_id)
         if not success:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -298,5 +533,18 @@ async def create_visualization(prompt: str) -> Dict[str, str]:
 
 
 if __name__ == "__main__":
-    # Run the FastAPI application with uvicorn server when script is executed directly
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Run the FastAPI application with uvicorn server when script is executed directly.
+    # "auto" selects the uvloop event loop and httptools parser when installed.
+    # Documents and connections are held in process memory, so run one worker
+    # unless WEB_CONCURRENCY says otherwise; set RELOAD=true for development.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        reload=os.getenv("RELOAD", "false").lower() == "true",
+        limit_concurrency=1000,
+        timeout_keep_alive=30,
+    )
@@ -0,0 +1,36 @@
+from typing import Any, Iterable
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class SelectiveGZipMiddleware:
+    """
+    Compress HTTP responses with gzip, except on the given paths.
+
+    Streaming endpoints are excluded because buffering for compression would
+    hold back every chunk until the compressor flushes.
+    """
+
+    def __init__(
+        self, app: ASGIApp, excluded_paths: Iterable[str], **gzip_options: Any
+    ):
+        """
+        Initialize the middleware.
+
+        Args:
+            app (ASGIApp): The application to wrap.
+            excluded_paths (Iterable[str]): Request paths whose responses are
+                never compressed.
+            **gzip_options (Any): Options passed on to GZipMiddleware, such as
+                minimum_size and compresslevel.
+        """
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, **gzip_options)
+        self.excluded_paths = frozenset(excluded_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] not in self.excluded_paths:
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
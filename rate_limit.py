@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from types import TracebackType
+from typing import Optional, Type
+
+# Configure logging for the rate limiting module
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many operations start per time period.
+
+    The bucket holds up to max_rate tokens and refills continuously at
+    max_rate per time_period. Each operation takes one token, waiting for it
+    when the bucket is empty, so bursts up to max_rate start at once and the
+    steady rate never exceeds it. Waiters are served in arrival order.
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 60.0):
+        """
+        Initialize a full bucket.
+
+        Args:
+            max_rate (float): Maximum number of operations per time period.
+            time_period (float, optional): Length of the period in seconds.
+                Defaults to 60.0.
+        """
+        self.max_rate = max_rate
+        self.time_period = time_period
+
+        # Tokens left and when they were last topped up
+        self._tokens = max_rate
+        self._updated_at = time.monotonic()
+
+        # Held while a caller waits for a token, so tokens go out in order
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Take a token, waiting until one is available.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.max_rate,
+                    self._tokens
+                    + (now - self._updated_at) * self.max_rate / self.time_period,
+                )
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                delay = (1 - self._tokens) * self.time_period / self.max_rate
+                logger.debug("Rate limit reached, waiting %.3f seconds", delay)
+                await asyncio.sleep(delay)
+
+    async def __aenter__(self) -> "RateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        return None
@@ -0,0 +1,139 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Configure logging for the semantic cache module
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Responses looked up by the cosine similarity of their questions' embeddings.
+
+    Each scope, such as an assistant configuration, has its own FAISS
+    inner-product index, so a question is only matched against questions that
+    were answered the same way. Embeddings must be normalized, which makes the
+    inner product equal to the cosine similarity.
+    """
+
+    def __init__(
+        self, threshold: float = 0.95, capacity: int = 1024, ttl: float = 300.0
+    ):
+        """
+        Initialize an empty cache.
+
+        Args:
+            threshold (float, optional): Minimum cosine similarity for a hit.
+                Defaults to 0.95.
+            capacity (int, optional): Maximum number of entries; the oldest are
+                evicted beyond it. Defaults to 1024.
+            ttl (float, optional): Seconds an entry is served. Defaults to 300.0.
+        """
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+
+        # Index per scope, mapping entry IDs to question embeddings
+        self._indexes: Dict[str, faiss.IndexIDMap2] = {}
+
+        # Entry ID to scope, response and expiry time, oldest first
+        self._entries: "OrderedDict[int, Tuple[str, str, float]]" = OrderedDict()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def search(self, embedding: np.ndarray, scope: str) -> Optional[str]:
+        """
+        Return the response to the most similar cached question in a scope.
+
+        Args:
+            embedding (np.ndarray): The normalized embedding of the question.
+            scope (str): The scope to search.
+
+        Returns:
+            Optional[str]: The cached response, or None when no question in the
+                scope is similar enough.
+        """
+        self._remove_expired()
+
+        index = self._indexes.get(scope)
+        if index is None:
+            return None
+
+        scores, ids = index.search(self._as_query(embedding), 1)
+        entry_id = int(ids[0][0])
+        if entry_id != -1 and scores[0][0] >= self.threshold:
+            return self._entries[entry_id][1]
+        return None
+
+    def add(self, embedding: np.ndarray, scope: str, response: str) -> None:
+        """
+        Cache a response under its question's embedding.
+
+        Args:
+            embedding (np.ndarray): The normalized embedding of the question.
+            scope (str): The scope the response belongs to.
+            response (str): The response to cache.
+        """
+        self._remove_expired()
+
+        query = self._as_query(embedding)
+        index = self._indexes.get(scope)
+        if index is None:
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(query.shape[1]))
+            self._indexes[scope] = index
+
+        entry_id = self._next_id
+        self._next_id += 1
+        index.add_with_ids(query, np.asarray([entry_id], dtype=np.int64))
+        self._entries[entry_id] = (scope, response, time.monotonic() + self.ttl)
+
+        # Evict the oldest entries beyond capacity
+        excess = len(self._entries) - self.capacity
+        if excess > 0:
+            self._remove(list(self._entries)[:excess])
+
+    @staticmethod
+    def _as_query(embedding: np.ndarray) -> np.ndarray:
+        """
+        Shape an embedding as the single-row float32 matrix FAISS expects.
+        """
+        return np.ascontiguousarray(embedding, dtype=np.float32).reshape(1, -1)
+
+    def _remove_expired(self) -> None:
+        """
+        Remove the entries whose TTL has passed.
+
+        Every entry has the same TTL, so entries expire in insertion order.
+        """
+        now = time.monotonic()
+        expired: List[int] = []
+        for entry_id, (_, _, expires_at) in self._entries.items():
+            if expires_at > now:
+                break
+            expired.append(entry_id)
+
+        if expired:
+            self._remove(expired)
+
+    def _remove(self, entry_ids: List[int]) -> None:
+        """
+        Remove entries from their indexes, dropping indexes left empty.
+        """
+        ids_by_scope: Dict[str, List[int]] = {}
+        for entry_id in entry_ids:
+            scope, _, _ = self._entries.pop(entry_id)
+            ids_by_scope.setdefault(scope, []).append(entry_id)
+
+        for scope, ids in ids_by_scope.items():
+            index = self._indexes[scope]
+            index.remove_ids(np.asarray(ids, dtype=np.int64))
+            if index.ntotal == 0:
+                del self._indexes[scope]
+
+        logger.debug("Removed %s semantic cache entries", len(entry_ids))
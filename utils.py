@@ -1,8 +1,14 @@
+import asyncio
+import csv
 import io
 import logging
+import multiprocessing
 import os
-from typing import Any, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
+import aiofiles
+import orjson
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pypdf import PdfReader
@@ -12,6 +18,193 @@ from vector_store import VectorStore
 # Configure logging for the utils module
 logger = logging.getLogger(__name__)
 
+# Text splitter shared by every upload, created on first use
+_text_splitter: Optional[RecursiveCharacterTextSplitter] = None
+
+# Process pool for CPU-bound PDF parsing, created on first use
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+# File extensions process_file can extract text from
+SUPPORTED_EXTENSIONS: FrozenSet[str] = frozenset(
+    {".pdf", ".txt", ".md", ".csv", ".json"}
+)
+
+# Data rows per CSV chunk; each chunk repeats the header row
+CSV_ROWS_PER_CHUNK = 50
+
+# Top-level array elements or object keys per JSON chunk
+JSON_ITEMS_PER_CHUNK = 10
+
+
+def _get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """
+    Get the shared text splitter, creating it on first use.
+
+    The splitter keeps no state between calls, so one instance serves every
+    upload. It is created lazily so CHUNK_SIZE and CHUNK_OVERLAP are read after
+    the application has loaded its environment.
+
+    Returns:
+        RecursiveCharacterTextSplitter: The shared text splitter.
+    """
+    global _text_splitter
+
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter(
+            # Characters per chunk
+            chunk_size=int(os.getenv("CHUNK_SIZE", "1000")),
+            # Overlap between chunks to maintain context
+            chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "200")),
+            length_function=len,  # Function to measure text length
+        )
+    return _text_splitter
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool used for PDF parsing, creating it on first use.
+
+    The workers are started from a forkserver, or spawned where that is not
+    available, because by the time the pool is created this process runs
+    several threads and forking it can deadlock the children.
+
+    Returns:
+        ProcessPoolExecutor: The shared PDF parsing pool.
+    """
+    global _pdf_pool
+
+    if _pdf_pool is None:
+        start_method = (
+            "forkserver"
+            if "forkserver" in multiprocessing.get_all_start_methods()
+            else "spawn"
+        )
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context(start_method),
+        )
+    return _pdf_pool
+
+
+def shutdown_pdf_pool() -> None:
+    """
+    Shut down the PDF parsing pool if it was started.
+
+    Intended to be called once when the application shuts down.
+    """
+    global _pdf_pool
+
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def _extract_pdf_text(file_path: str) -> Tuple[str, int]:
+    """
+    Extract the text of a PDF, marking the end of each page.
+
+    Runs in a worker process, so it must stay a picklable top-level function.
+    It reads the file itself so the content is never copied between processes.
+
+    Args:
+        file_path (str): The path of the PDF file.
+
+    Returns:
+        Tuple[str, int]: The extracted text and the number of pages.
+    """
+    parts: List[str] = []
+    pdf = PdfReader(file_path)
+    for page_num, page in enumerate(pdf.pages):
+        # Extract text from each page, collecting the parts to join once
+        parts.append(page.extract_text() or "")  # Handle None returns
+        parts.append(f"\n\n[Page {page_num + 1}]\n\n")
+    return "".join(parts), len(pdf.pages)
+
+
+def _split_csv(text: str, max_chars: int) -> List[str]:
+    """
+    Split CSV text into chunks of whole rows, each starting with the header.
+
+    A chunk holds at most CSV_ROWS_PER_CHUNK rows and is closed early once
+    another row would take it past max_chars. A single row longer than that
+    still gets a chunk of its own, so no record is cut.
+
+    Args:
+        text (str): The CSV text.
+        max_chars (int): Characters a chunk should not exceed.
+
+    Returns:
+        List[str]: The chunks, in CSV format.
+    """
+    rows: List[List[str]] = list(csv.reader(io.StringIO(text, newline="")))
+    if not rows:
+        return []
+
+    # Write through csv so quoted fields stay intact
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    def format_row(row: List[str]) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    header: str = format_row(rows[0])
+    chunks: List[str] = []
+    current: List[str] = []
+    size: int = len(header)
+    for row in rows[1:]:
+        line: str = format_row(row)
+        if current and (
+            len(current) >= CSV_ROWS_PER_CHUNK or size + len(line) > max_chars
+        ):
+            chunks.append(header + "".join(current))
+            current, size = [], len(header)
+        current.append(line)
+        size += len(line)
+
+    # A file with only a header still yields one chunk
+    if current or not chunks:
+        chunks.append(header + "".join(current))
+    return chunks
+
+
+def _split_json(content: bytes) -> List[str]:
+    """
+    Split a JSON document into chunks along its top-level elements.
+
+    Arrays are chunked by element and objects by key. Any other value is kept
+    as a single chunk.
+
+    Args:
+        content (bytes): The JSON document.
+
+    Returns:
+        List[str]: The chunks, each a JSON document.
+
+    Raises:
+        orjson.JSONDecodeError: If the content is not valid JSON.
+    """
+    value: Any = orjson.loads(content)
+
+    if isinstance(value, list):
+        return [
+            orjson.dumps(value[start : start + JSON_ITEMS_PER_CHUNK]).decode("utf-8")
+            for start in range(0, len(value), JSON_ITEMS_PER_CHUNK)
+        ]
+
+    if isinstance(value, dict):
+        keys: List[str] = list(value)
+        return [
+            orjson.dumps(
+                {key: value[key] for key in keys[start : start + JSON_ITEMS_PER_CHUNK]}
+            ).decode("utf-8")
+            for start in range(0, len(keys), JSON_ITEMS_PER_CHUNK)
+        ]
+
+    return [orjson.dumps(value).decode("utf-8")]
+
 
 def get_file_extension(filename: str) -> str:
     """
@@ -35,28 +228,68 @@ def get_file_extension(filename: str) -> str:
     return extension
 
 
+async def _read_text(file_path: str, newline: Optional[str] = None) -> str:
+    """
+    Read a UTF-8 text file without blocking the event loop.
+
+    Args:
+        file_path (str): The path of the file.
+        newline (Optional[str], optional): Newline mode, as for open. Pass ""
+            to keep line endings untranslated. Defaults to None.
+
+    Returns:
+        str: The content of the file.
+    """
+    async with aiofiles.open(file_path, "r", encoding="utf-8", newline=newline) as f:
+        return await f.read()
+
+
+async def _read_bytes(file_path: str) -> bytes:
+    """
+    Read a file without blocking the event loop.
+
+    Args:
+        file_path (str): The path of the file.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    async with aiofiles.open(file_path, "rb") as f:
+        return await f.read()
+
+
 async def process_file(
-    file_content: bytes,
+    file_path: str,
     filename: str,
     document_id: str,
     metadata: Dict[str, Any],
     vector_store: VectorStore,
+    content_hash: Optional[str] = None,
 ) -> None:
     """
     Process a file and add it to the vector store.
 
     This function:
     1. Extracts text from various file types (PDF, TXT, MD, CSV, JSON)
-    2. Splits the text into manageable chunks
+    2. Splits the text into manageable chunks, along rows for CSV and along
+       top-level elements for JSON
     3. Creates Document objects with metadata
     4. Adds the documents to the vector store
 
+    When content_hash matches a stored document, the file is not processed
+    again and the new document refers to the stored one instead.
+
+    The file at file_path is deleted once processing finishes, whether or not
+    it succeeded.
+
     Args:
-        file_content (bytes): The binary content of the file.
+        file_path (str): The path of the uploaded file's temporary copy.
         filename (str): The name of the file.
         document_id (str): A unique identifier for the document.
         metadata (Dict[str, Any]): Additional metadata to store with the document.
         vector_store (VectorStore): The vector store instance to add the document to.
+        content_hash (Optional[str], optional): SHA-256 hex digest of the file
+            content. Defaults to None.
 
     Returns:
         None
@@ -65,6 +298,15 @@ async def process_file(
         Exception: Exceptions are caught and logged, not propagated.
     """
     try:
+        # Skip extraction, chunking and uploading for content already stored
+        if content_hash:
+            source_document_id = vector_store.find_document_by_hash(content_hash)
+            if source_document_id is not None:
+                vector_store.add_document_reference(
+                    document_id, filename, source_document_id, metadata
+                )
+                return
+
         # Determine file type based on extension
         file_extension: str = get_file_extension(filename)
         logger.debug(
@@ -74,48 +316,59 @@ async def process_file(
         # Extract text based on file type - different handling for each supported format
         text: str = ""
 
+        # Chunks of structured formats, which are split along their records
+        # instead of by the text splitter
+        chunks: Optional[List[str]] = None
+
+        loop = asyncio.get_running_loop()
+
         if file_extension == ".pdf":
-            # PDF file handling
-            pdf = PdfReader(io.BytesIO(file_content))
-            for page_num, page in enumerate(pdf.pages):
-                # Extract text from each page and concatenate
-                page_text = page.extract_text() or ""  # Handle None returns
-                text += page_text + f"\n\n[Page {page_num + 1}]\n\n"
-            logger.debug("Extracted text from PDF with %d pages", len(pdf.pages))
+            # PDF parsing is CPU-bound, so run it in a worker process to keep
+            # the event loop free for other requests
+            text, page_count = await loop.run_in_executor(
+                _get_pdf_pool(), _extract_pdf_text, file_path
+            )
+            logger.debug("Extracted text from PDF with %d pages", page_count)
 
         elif file_extension in (".txt", ".md"):
             # Plain text or Markdown file handling
-            text = file_content.decode("utf-8")
+            text = await _read_text(file_path)
             logger.debug("Decoded text file as UTF-8")
 
         elif file_extension == ".csv":
-            # Simple CSV handling - more complex handling might be needed
-            # For production, consider using pandas or dedicated CSV parsers
-            text = file_content.decode("utf-8")
-            logger.debug("Decoded CSV file as UTF-8")
+            # Split along rows so every chunk holds whole records
+            # csv handles line endings itself, including inside quoted fields
+            text = await _read_text(file_path, newline="")
+            chunks = await loop.run_in_executor(
+                None, _split_csv, text, int(os.getenv("CHUNK_SIZE", "1000"))
+            )
+            logger.debug("Split CSV file along rows")
 
         elif file_extension == ".json":
-            # Simple JSON handling - treated as text
-            # For production, consider parsing and structured handling
-            text = file_content.decode("utf-8")
-            logger.debug("Decoded JSON file as UTF-8")
+            # Split along top-level elements, falling back to plain text for
+            # files that do not parse
+            content: bytes = await _read_bytes(file_path)
+            try:
+                chunks = await loop.run_in_executor(None, _split_json, content)
+                logger.debug("Split JSON file along top-level elements")
+            except orjson.JSONDecodeError as e:
+                logger.warning("Treating %s as text: %s", filename, str(e))
+                text = content.decode("utf-8")
 
         else:
             logger.warning("Unsupported file extension: %s", file_extension)
             return
 
-        # Skip processing if no text was extracted
-        if not text.strip():
-            logger.warning("No text content extracted from %s", filename)
-            return
+        if chunks is None:
+            # Skip processing if no text was extracted
+            if not text.strip():
+                logger.warning("No text content extracted from %s", filename)
+                return
 
-        # Split text into chunks for better processing and retrieval
-        text_splitter: RecursiveCharacterTextSplitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,  # Characters per chunk
-            chunk_overlap=200,  # Overlap between chunks to maintain context
-            length_function=len,  # Function to measure text length
-        )
-        chunks: List[str] = text_splitter.split_text(text)
+            # Split text into chunks for better processing and retrieval
+            text_splitter: RecursiveCharacterTextSplitter = _get_text_splitter()
+            # Splitting scans the whole text, so keep it off the event loop as well
+            chunks = await loop.run_in_executor(None, text_splitter.split_text, text)
         logger.info("Split %s into %d chunks", filename, len(chunks))
 
         # Create Document objects with metadata for each chunk
@@ -144,7 +397,9 @@ async def process_file(
 
         # Add documents to vector store if we have any
         if documents:
-            await vector_store.add_documents(documents, document_id, filename, metadata)
+            await vector_store.add_documents(
+                documents, document_id, filename, metadata, content_hash
+            )
             logger.info(
                 "Successfully processed %s with %d chunks added to vector store",
                 filename,
@@ -156,3 +411,9 @@ async def process_file(
     except Exception as e:
         # Log the error but don't propagate it - this is typically run as a background task
         logger.error("Error processing file %s: %s", filename, str(e), exc_info=True)
+    finally:
+        # The upload was spooled to a temporary file for this task alone
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
@@ -2,16 +2,64 @@ import asyncio
 import logging
 import os
 import pickle
+import random
+import sqlite3
+import time
 import uuid
 from datetime import datetime
-from typing import Any, Dict, List, Optional, cast
+from typing import (Any, Awaitable, Callable, Dict, List, Optional, Sequence,
+                    Set, Tuple, TypeVar, cast)
 
+import orjson
 from langchain.schema import Document
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, RateLimitError
+
+from clients import get_openai_client
+from rate_limit import RateLimiter
 
 # Configure logging for the vector store module
 logger = logging.getLogger(__name__)
 
+# File batch polling starts after this many seconds, backs off up to the
+# maximum delay and gives up after the timeout
+BATCH_POLL_INITIAL_DELAY: float = 0.25
+BATCH_POLL_MAX_DELAY: float = 8.0
+BATCH_POLL_TIMEOUT: float = 300.0
+
+# Maximum number of documents delete_documents deletes at once
+MAX_CONCURRENT_DELETES: int = 8
+
+# Maximum number of files uploaded to OpenAI at once
+MAX_CONCURRENT_UPLOADS: int = 16
+
+ResultT = TypeVar("ResultT")
+
+# Name of the SQLite database holding the persisted mappings
+DATABASE_FILE: str = "store.db"
+
+# Table, key column and value column persisting each mapping, keyed by the
+# name of the metadata file it was saved to before
+MAPPING_TABLES: Dict[str, Tuple[str, str, str]] = {
+    "metadata": ("documents", "document_id", "metadata"),
+    "file_ids": ("file_ids", "document_id", "file_id"),
+    "vector_stores": ("vector_stores", "name", "vector_store_id"),
+}
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_ids (
+    document_id TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vector_stores (
+    name TEXT PRIMARY KEY,
+    vector_store_id TEXT NOT NULL
+);
+"""
+
 
 class VectorStore:
     """
@@ -22,115 +70,312 @@ class VectorStore:
     storage, and deletion of documents in OpenAI's vector stores.
     """
 
-    def __init__(self, persist_directory: str = "vector_store"):
+    def __init__(
+        self, persist_directory: str = "vector_store", requests_per_minute: int = 500
+    ):
         """
         Initialize the vector store using OpenAI's vector stores API.
 
         Args:
             persist_directory (str, optional): Directory to store persistent data.
                 Defaults to "vector_store".
+            requests_per_minute (int, optional): Maximum number of OpenAI API
+                requests the store starts per minute. Defaults to 500.
         """
         self.persist_directory: str = persist_directory
-        self.client: AsyncOpenAI = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self._database_path: str = os.path.join(persist_directory, DATABASE_FILE)
+        # Share the application's OpenAI client and its connection pool
+        self.client: AsyncOpenAI = get_openai_client()
+
+        # Spaces out OpenAI requests so bursts of concurrent uploads and
+        # deletions stay under the rate limit instead of being rejected
+        self._rate_limiter = RateLimiter(requests_per_minute, 60.0)
+
+        # Persisted mappings keyed by their MAPPING_TABLES name, each loaded
+        # from the database on first access; see the properties below
+        self._mappings: Dict[str, Dict[str, Any]] = {}
 
-        # Store document metadata indexed by document_id
-        self.document_metadata: Dict[str, Dict[str, Any]] = {}
+        # Reverse mapping from vector store IDs to their names, rebuilt when
+        # the vector stores mapping is loaded
+        self._vector_store_names: Dict[str, str] = {}
 
-        # Mapping from document_id to OpenAI file_id
-        self.file_ids: Dict[str, str] = {}
+        # ID of the vector store documents are added to, once known
+        self._vector_store_id: Optional[str] = None
 
-        # Mapping from vector store names to their IDs
-        self.vector_stores: Dict[str, str] = {}
+        # Limits the file uploads in flight across all additions
+        self._upload_semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
+        # Incremented on every change to the documents or vector stores, so
+        # callers can tell when cached views of them are stale
+        self.version: int = 0
+
+        # Document list returned by list_documents and the version it was
+        # built at
+        self._documents_list: List[Dict[str, Any]] = []
+        self._documents_list_version: int = -1
+
+        # Database connection, opened on first use, and its data version as
+        # last seen, used to pick up changes written by another process
+        self._connection: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
 
         # Create directory if it doesn't exist
         os.makedirs(self.persist_directory, exist_ok=True)
 
-        # Load existing metadata if available
-        self._load_metadata()
+    @property
+    def document_metadata(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Document metadata indexed by document_id, loaded from the documents table.
+        """
+        return cast(Dict[str, Dict[str, Any]], self._get_mapping("metadata"))
 
-    def _load_metadata(self) -> None:
+    @property
+    def file_ids(self) -> Dict[str, str]:
+        """
+        Mapping from document_id to OpenAI file_id, loaded from the file_ids table.
         """
-        Load document metadata from disk if it exists.
+        return cast(Dict[str, str], self._get_mapping("file_ids"))
 
-        This method attempts to load three pickle files:
-        - metadata.pkl: Contains document metadata
-        - file_ids.pkl: Contains mapping of document IDs to file IDs
-        - vector_stores.pkl: Contains mapping of vector store names to IDs
+    @property
+    def vector_stores(self) -> Dict[str, str]:
+        """
+        Mapping from vector store names to their IDs, loaded from the
+        vector_stores table.
+        """
+        return cast(Dict[str, str], self._get_mapping("vector_stores"))
 
-        If any file fails to load, the corresponding attribute is initialized as an empty dict.
+    def _get_connection(self) -> sqlite3.Connection:
         """
-        metadata_path: str = os.path.join(self.persist_directory, "metadata.pkl")
-        file_ids_path: str = os.path.join(self.persist_directory, "file_ids.pkl")
-        vector_stores_path: str = os.path.join(
-            self.persist_directory, "vector_stores.pkl"
-        )
+        Get the database connection, opening it on first use.
 
-        # Load document metadata
-        if os.path.exists(metadata_path):
-            try:
-                with open(metadata_path, "rb") as f:
-                    self.document_metadata = cast(
-                        Dict[str, Dict[str, Any]], pickle.load(f)
-                    )
-                logger.info("Loaded document metadata from %s", metadata_path)
-            except Exception as e:
-                logger.error("Error loading metadata: %s", str(e))
-                self.document_metadata = {}
+        The database uses write-ahead logging, so the API and the ingestion
+        worker can read it while the other writes. Metadata files written by
+        earlier versions are imported when it is opened.
 
-        # Load file IDs mapping
-        if os.path.exists(file_ids_path):
-            try:
-                with open(file_ids_path, "rb") as f:
-                    self.file_ids = cast(Dict[str, str], pickle.load(f))
-                logger.info("Loaded file IDs from %s", file_ids_path)
-            except Exception as e:
-                logger.error("Error loading file IDs: %s", str(e))
-                self.file_ids = {}
+        Returns:
+            sqlite3.Connection: The connection, in autocommit mode.
+        """
+        if self._connection is None:
+            connection: sqlite3.Connection = sqlite3.connect(
+                self._database_path, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
 
-        # Load vector stores mapping
-        if os.path.exists(vector_stores_path):
-            try:
-                with open(vector_stores_path, "rb") as f:
-                    self.vector_stores = cast(Dict[str, str], pickle.load(f))
-                logger.info("Loaded vector store IDs from %s", vector_stores_path)
-            except Exception as e:
-                logger.error("Error loading vector store IDs: %s", str(e))
-                self.vector_stores = {}
+            self._migrate_files()
+            self._data_version = self._get_data_version()
+        return self._connection
 
-    def _save_metadata(self) -> None:
+    def close(self) -> None:
         """
-        Save document metadata to disk.
+        Close the database connection.
 
-        This method saves the current state of three attributes to pickle files:
-        - document_metadata: Saved to metadata.pkl
-        - file_ids: Saved to file_ids.pkl
-        - vector_stores: Saved to vector_stores.pkl
+        Intended to be called when the application shuts down. The connection
+        is opened again if the store is used afterwards.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
 
-        This ensures persistence across application restarts.
+    def _get_mapping(self, name: str) -> Dict[str, Any]:
         """
-        try:
-            # Save document metadata
-            metadata_path: str = os.path.join(self.persist_directory, "metadata.pkl")
-            with open(metadata_path, "wb") as f:
-                pickle.dump(self.document_metadata, f)
-
-            # Save file IDs mapping
-            file_ids_path: str = os.path.join(self.persist_directory, "file_ids.pkl")
-            with open(file_ids_path, "wb") as f:
-                pickle.dump(self.file_ids, f)
-
-            # Save vector stores mapping
-            vector_stores_path: str = os.path.join(
-                self.persist_directory, "vector_stores.pkl"
-            )
-            with open(vector_stores_path, "wb") as f:
-                pickle.dump(self.vector_stores, f)
+        Get a persisted mapping, loading it from the database on first access.
+
+        If the table fails to load, the mapping starts out empty.
+
+        Args:
+            name (str): The mapping's name in MAPPING_TABLES.
 
-            logger.info(
-                "Saved document metadata, file IDs, and vector store IDs to disk"
+        Returns:
+            Dict[str, Any]: The mapping.
+        """
+        mapping: Optional[Dict[str, Any]] = self._mappings.get(name)
+        if mapping is not None:
+            return mapping
+
+        table, key_column, value_column = MAPPING_TABLES[name]
+        try:
+            # Rows are read in insertion order, like the mappings they replace
+            rows = self._get_connection().execute(
+                f"SELECT {key_column}, {value_column} FROM {table} ORDER BY rowid"
             )
+            if name == "metadata":
+                mapping = {key: orjson.loads(value) for key, value in rows}
+            else:
+                mapping = dict(rows)
+            logger.info("Loaded %s from the database", name)
         except Exception as e:
-            logger.error("Error saving metadata: %s", str(e))
+            logger.error("Error loading %s: %s", name, str(e))
+            mapping = {}
+        self._mappings[name] = mapping
+
+        if name == "vector_stores":
+            self._vector_store_names = {
+                vs_id: vs_name for vs_name, vs_id in mapping.items()
+            }
+
+        return mapping
+
+    def _load_file(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Load one mapping from a metadata file written by an earlier version,
+        which is JSON or, in older versions, a pickle.
+
+        Args:
+            name (str): The file name without its extension.
+
+        Returns:
+            Optional[Dict[str, Any]]: The mapping, or None if neither file exists.
+
+        Raises:
+            orjson.JSONDecodeError: If the JSON file is corrupt.
+        """
+        # Open each file directly rather than checking that it exists first
+        try:
+            with open(os.path.join(self.persist_directory, f"{name}.json"), "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(os.path.join(self.persist_directory, f"{name}.pkl"), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _migrate_files(self) -> None:
+        """
+        Import the metadata files written by earlier versions into the
+        database and remove them.
+
+        A file is only imported while its table is empty, so a file left
+        behind never overwrites newer rows. Files that fail to import are kept.
+        """
+        connection: sqlite3.Connection = cast(sqlite3.Connection, self._connection)
+
+        for name, (table, key_column, value_column) in MAPPING_TABLES.items():
+            try:
+                mapping: Optional[Dict[str, Any]] = self._load_file(name)
+                if mapping is None:
+                    continue
+
+                if connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    logger.warning("Ignoring %s, which is already migrated", name)
+                else:
+                    with connection:
+                        connection.execute("BEGIN")
+                        connection.executemany(
+                            f"INSERT OR IGNORE INTO {table} "
+                            f"({key_column}, {value_column}) VALUES (?, ?)",
+                            (
+                                (key, self._encode_value(name, value))
+                                for key, value in mapping.items()
+                            ),
+                        )
+                    logger.info("Migrated %s to the database", name)
+
+                for extension in ("json", "pkl"):
+                    try:
+                        os.remove(
+                            os.path.join(self.persist_directory, f"{name}.{extension}")
+                        )
+                    except FileNotFoundError:
+                        pass
+            except Exception as e:
+                logger.error("Error migrating %s: %s", name, str(e))
+
+    @staticmethod
+    def _encode_value(name: str, value: Any) -> Any:
+        """
+        Convert a mapping value to the form stored in its table, which is JSON
+        for document metadata.
+        """
+        if name == "metadata":
+            return orjson.dumps(value).decode("utf-8")
+        return value
+
+    def _write_rows(self, changes: Sequence[Tuple[str, str, Any]]) -> None:
+        """
+        Persist changed mapping entries in a single transaction.
+
+        Only the given rows are written, so the cost of a change does not grow
+        with the number of documents.
+
+        Args:
+            changes (Sequence[Tuple[str, str, Any]]): The mapping name, key and
+                new value of each changed entry. A value of None deletes the
+                entry.
+
+        Raises:
+            sqlite3.Error: If the rows cannot be written; none of them are.
+        """
+        connection: sqlite3.Connection = self._get_connection()
+        with connection:
+            connection.execute("BEGIN")
+            for name, key, value in changes:
+                table, key_column, value_column = MAPPING_TABLES[name]
+                if value is None:
+                    connection.execute(
+                        f"DELETE FROM {table} WHERE {key_column} = ?", (key,)
+                    )
+                else:
+                    connection.execute(
+                        f"INSERT INTO {table} ({key_column}, {value_column}) "
+                        f"VALUES (?, ?) ON CONFLICT ({key_column}) "
+                        f"DO UPDATE SET {value_column} = excluded.{value_column}",
+                        (key, self._encode_value(name, value)),
+                    )
+
+    def _get_data_version(self) -> int:
+        """
+        Get the database's data version, which changes whenever another
+        connection commits a change.
+        """
+        return self._get_connection().execute("PRAGMA data_version").fetchone()[0]
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the metadata if another process has changed it since it was loaded.
+
+        Used when documents are ingested by a separate worker process. The
+        mappings are dropped and loaded again on their next access.
+
+        Returns:
+            bool: True if the metadata was reloaded.
+        """
+        if self._connection is None:
+            # Nothing has been loaded yet
+            return False
+
+        data_version: int = self._get_data_version()
+        if data_version == self._data_version:
+            return False
+
+        self._mappings.clear()
+        self._vector_store_id = None
+        self._data_version = data_version
+        self.version += 1
+        logger.info("Reloaded metadata changed by another process")
+        return True
+
+    async def _throttled(
+        self, request: Callable[..., Awaitable[ResultT]], *args: Any, **kwargs: Any
+    ) -> ResultT:
+        """
+        Make an OpenAI API request once the rate limiter allows it.
+
+        Args:
+            request (Callable[..., Awaitable[ResultT]]): The client method to call.
+            *args (Any): Positional arguments for the request.
+            **kwargs (Any): Keyword arguments for the request.
+
+        Returns:
+            ResultT: The request's result.
+        """
+        async with self._rate_limiter:
+            return await request(*args, **kwargs)
 
     async def _ensure_vector_store_exists(self) -> str:
         """
@@ -138,6 +383,7 @@ class VectorStore:
 
         This method checks if there's an existing vector store and creates one if none exists.
         It automatically sets a 30-day expiration policy based on last activity.
+        The ID is remembered until the metadata is reloaded.
 
         Returns:
             str: The ID of an available vector store.
@@ -145,6 +391,9 @@ class VectorStore:
         Raises:
             Exception: If creating or retrieving a vector store fails.
         """
+        if self._vector_store_id is not None:
+            return self._vector_store_id
+
         try:
             # Check if we have an existing vector store
             if not self.vector_stores:
@@ -152,44 +401,126 @@ class VectorStore:
                 vector_store_name: str = f"vs_{uuid.uuid4().hex[:8]}"
 
                 # Create vector store with 30-day expiration after last activity
-                vector_store = await self.client.beta.vector_stores.create(
+                vector_store = await self._throttled(
+                    self.client.beta.vector_stores.create,
                     name=vector_store_name,
                     expires_after={"anchor": "last_active_at", "days": 30},
                 )
                 vector_store_id: str = vector_store.id
 
                 # Store the new vector store
+                self._write_rows(
+                    [("vector_stores", vector_store_name, vector_store_id)]
+                )
                 self.vector_stores[vector_store_name] = vector_store_id
+                self._vector_store_names[vector_store_id] = vector_store_name
+                self.version += 1
                 logger.info(
                     "Created new vector store: %s with ID %s",
                     vector_store_name,
                     vector_store_id,
                 )
 
-                # Save the updated metadata
-                self._save_metadata()
-
+                self._vector_store_id = vector_store_id
                 return vector_store_id
             else:
                 # Return the first available vector store
-                vector_store_name = list(self.vector_stores.keys())[0]
+                vector_store_name = next(iter(self.vector_stores))
                 vector_store_id = self.vector_stores[vector_store_name]
                 logger.debug(
                     "Using existing vector store: %s with ID %s",
                     vector_store_name,
                     vector_store_id,
                 )
+                self._vector_store_id = vector_store_id
                 return vector_store_id
         except Exception as e:
             logger.error("Error ensuring vector store exists: %s", str(e))
             raise e
 
+    async def _wait_for_file_batch(
+        self, vector_store_id: str, file_batch_id: str
+    ) -> Any:
+        """
+        Poll a file batch until it finishes or the polling budget runs out.
+
+        Polls start quickly and back off exponentially with full jitter, so
+        small batches are seen as soon as they complete without polling large
+        ones too often. A rate-limited poll waits the maximum delay before the
+        next one.
+
+        Args:
+            vector_store_id (str): The ID of the vector store.
+            file_batch_id (str): The ID of the file batch.
+
+        Returns:
+            Any: The batch as last retrieved.
+
+        Raises:
+            Exception: If the batch fails or is cancelled.
+            RateLimitError: If polls are still rate limited when the polling
+                budget runs out.
+        """
+        deadline: float = time.monotonic() + BATCH_POLL_TIMEOUT
+        attempt: int = 0
+
+        while True:
+            # Check batch status, backing off further while rate limited
+            try:
+                batch_status = await self._throttled(
+                    self.client.beta.vector_stores.file_batches.retrieve,
+                    vector_store_id=vector_store_id,
+                    file_batch_id=file_batch_id,
+                )
+            except RateLimitError as e:
+                remaining: float = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise e
+                logger.warning(
+                    "Polling batch %s was rate limited: %s", file_batch_id, str(e)
+                )
+                await asyncio.sleep(min(BATCH_POLL_MAX_DELAY, remaining))
+                attempt += 1
+                continue
+
+            if batch_status.status == "completed":
+                logger.info("Batch %s completed successfully", file_batch_id)
+                return batch_status
+            elif batch_status.status in ("failed", "cancelled"):
+                logger.error(
+                    "Batch %s failed with status: %s",
+                    file_batch_id,
+                    batch_status.status,
+                )
+                raise Exception(f"File batch processing failed: {batch_status.status}")
+
+            # Handle timeout case
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(
+                    "Batch %s is still processing after %s seconds",
+                    file_batch_id,
+                    BATCH_POLL_TIMEOUT,
+                )
+                return batch_status
+
+            # Wait before checking again
+            delay: float = min(
+                random.uniform(
+                    0, min(BATCH_POLL_MAX_DELAY, BATCH_POLL_INITIAL_DELAY * 2**attempt)
+                ),
+                remaining,
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
     async def add_documents(
         self,
         documents: List[Document],
         document_id: str,
         filename: str,
         metadata: Optional[Dict[str, Any]] = None,
+        content_hash: Optional[str] = None,
     ) -> bool:
         """
         Add documents to the OpenAI vector store.
@@ -205,6 +536,9 @@ class VectorStore:
             document_id (str): Unique identifier for the document.
             filename (str): Original filename of the document.
             metadata (Optional[Dict[str, Any]], optional): Additional metadata. Defaults to None.
+            content_hash (Optional[str], optional): SHA-256 hex digest of the
+                uploaded file, used to recognize later uploads of the same
+                content. Defaults to None.
 
         Returns:
             bool: True if documents were added successfully.
@@ -212,172 +546,303 @@ class VectorStore:
         Raises:
             Exception: If there's an error during the document addition process.
         """
-        try:
-            # First, upload the file to OpenAI by creating a temporary file
-            temp_filename: str = f"{document_id}.txt"
-            temp_filepath: str = os.path.join(self.persist_directory, temp_filename)
-
-            # Combine all chunks into one string for the file
-            # Each chunk is labeled with its position in the sequence
-            combined_text: str = ""
-            for i, doc in enumerate(documents):
-                chunk_info = f"--- Chunk {i+1}/{len(documents)} ---\n"
-                combined_text += chunk_info + doc.page_content + "\n\n"
-
-            # Write combined content to temporary file
-            with open(temp_filepath, "wb") as f:
-                f.write(combined_text.encode("utf-8"))
-
-            # Upload temporary file to OpenAI
-            with open(temp_filepath, "rb") as f:
-                file_response = await self.client.files.create(
-                    file=f, purpose="assistants"
-                )
+        results: Dict[str, bool] = await self.add_documents_bulk(
+            [(documents, document_id, filename, metadata, content_hash)]
+        )
+        if not results[document_id]:
+            raise Exception(f"Failed to add document {document_id}")
+        return True
 
-            # Store file ID mapping
-            file_id: str = file_response.id
-            self.file_ids[document_id] = file_id
-            logger.info("Uploaded file to OpenAI with ID: %s", file_id)
+    async def add_documents_bulk(
+        self,
+        items: Sequence[
+            Tuple[List[Document], str, str, Optional[Dict[str, Any]], Optional[str]]
+        ],
+        batch_size: int = 32,
+    ) -> Dict[str, bool]:
+        """
+        Add several documents to the OpenAI vector store, indexing up to
+        batch_size of them in each file batch.
 
-            # Ensure we have a vector store available
-            vector_store_id: str = await self._ensure_vector_store_exists()
+        Each document's chunks are combined into one file and the files are
+        uploaded concurrently, at most MAX_CONCURRENT_UPLOADS at a time. A
+        group's files are then added to the vector store with a single file
+        batch, so the group waits for one batch to complete instead of one per
+        document.
 
-            # Try to add file to vector store using the recommended upload_and_poll method
-            try:
-                # Create file batch and poll until complete
-                with open(temp_filepath, "rb") as f:
-                    file_batch = await self.client.beta.vector_stores.file_batches.upload_and_poll(
-                        vector_store_id=vector_store_id, files=[f]
-                    )
+        Args:
+            items (Sequence[Tuple[List[Document], str, str, Optional[Dict[str, Any]], Optional[str]]]):
+                The chunks, document ID, original filename, additional metadata
+                and content hash of each document, as passed to add_documents.
+            batch_size (int, optional): Maximum number of documents per file
+                batch. Defaults to 32.
 
-                # Check file batch status
-                if file_batch.status != "completed":
-                    logger.error(
-                        "File batch processing did not complete successfully: %s",
-                        file_batch.status,
-                    )
-                    raise Exception(
-                        f"File batch processing failed: {file_batch.status}"
-                    )
+        Returns:
+            Dict[str, bool]: Whether each document was added, keyed by its ID.
 
-                logger.info(
-                    "Successfully added file to vector store: %s",
-                    (
-                        file_batch.file_counts
-                        if hasattr(file_batch, "file_counts")
-                        else "N/A"
-                    ),
-                )
+        Raises:
+            Exception: If a vector store or file batch cannot be created, or a
+                file batch fails.
+        """
+        results: Dict[str, bool] = {}
+        for start in range(0, len(items), batch_size):
+            results.update(
+                await self._add_document_group(items[start : start + batch_size])
+            )
+        return results
 
-            except Exception as e:
-                # First approach failed, try alternate method
-                logger.error(
-                    "Error adding file to vector store using upload_and_poll: %s",
-                    str(e),
-                )
+    @staticmethod
+    def _build_file_content(documents: List[Document]) -> bytes:
+        """
+        Combine a document's chunks into the content of the file uploaded for it.
 
-                # Try alternate approach using file IDs
-                try:
-                    logger.info("Trying alternate approach with file IDs...")
+        Each chunk is labeled with its position in the sequence, and the parts
+        are collected to be joined once.
+        """
+        chunk_count: int = len(documents)
+        parts: List[str] = []
+        for i, doc in enumerate(documents):
+            parts.append(f"--- Chunk {i+1}/{chunk_count} ---\n")
+            parts.append(doc.page_content)
+            parts.append("\n\n")
+        return "".join(parts).encode("utf-8")
+
+    async def _upload_file(self, document_id: str, documents: List[Document]) -> Any:
+        """
+        Upload a document's combined chunks to OpenAI straight from memory.
 
-                    # Create file batch using the file ID we obtained earlier
-                    file_batch = (
-                        await self.client.beta.vector_stores.file_batches.create(
-                            vector_store_id=vector_store_id, file_ids=[file_id]
-                        )
-                    )
+        Args:
+            document_id (str): The ID of the document.
+            documents (List[Document]): The document's chunks.
 
-                    # Poll for completion with timeout
-                    max_attempts: int = 30
-                    attempts: int = 0
-
-                    while attempts < max_attempts:
-                        # Check batch status
-                        batch_status = (
-                            await self.client.beta.vector_stores.file_batches.retrieve(
-                                vector_store_id=vector_store_id,
-                                file_batch_id=file_batch.id,
-                            )
-                        )
+        Returns:
+            Any: The uploaded file.
+        """
+        content: bytes = self._build_file_content(documents)
+        async with self._upload_semaphore:
+            return await self._throttled(
+                self.client.files.create,
+                file=(f"{document_id}.txt", content),
+                purpose="assistants",
+            )
 
-                        if batch_status.status == "completed":
-                            logger.info(
-                                "Batch %s completed successfully", file_batch.id
-                            )
-                            break
-                        elif batch_status.status in ["failed", "cancelled"]:
-                            logger.error(
-                                "Batch %s failed with status: %s",
-                                file_batch.id,
-                                batch_status.status,
-                            )
-                            raise Exception(
-                                f"File batch processing failed: {batch_status.status}"
-                            )
-
-                        # Wait before checking again
-                        await asyncio.sleep(2)
-                        attempts += 1
-
-                    # Handle timeout case
-                    if attempts >= max_attempts:
-                        logger.warning(
-                            "Batch %s is still processing after %s attempts",
-                            file_batch.id,
-                            max_attempts,
-                        )
+    async def _add_document_group(
+        self,
+        items: Sequence[
+            Tuple[List[Document], str, str, Optional[Dict[str, Any]], Optional[str]]
+        ],
+    ) -> Dict[str, bool]:
+        """
+        Upload a group of documents and index them with one file batch.
 
-                except Exception as inner_e:
-                    logger.error("Error in alternate approach: %s", str(inner_e))
-                    raise inner_e
-
-            # Prepare document metadata
-            base_metadata: Dict[str, Any] = {
-                "document_id": document_id,
-                "filename": filename,
-                "file_id": file_id,
-                "vector_store_id": vector_store_id,
-                "vector_store_name": next(
-                    k for k, v in self.vector_stores.items() if v == vector_store_id
+        Args:
+            items (Sequence[Tuple[List[Document], str, str, Optional[Dict[str, Any]], Optional[str]]]):
+                The documents, as passed to add_documents_bulk.
+
+        Returns:
+            Dict[str, bool]: Whether each document was added, keyed by its ID.
+
+        Raises:
+            Exception: If the vector store or file batch cannot be created, or
+                the file batch fails.
+        """
+        try:
+            # Upload the combined content of every document concurrently
+            uploads: List[Any] = await asyncio.gather(
+                *(
+                    self._upload_file(document_id, documents)
+                    for documents, document_id, _, _, _ in items
                 ),
-                "added_at": datetime.now().isoformat(),  # Use ISO format timestamp
-                "num_chunks": len(documents),
-            }
+                return_exceptions=True,
+            )
 
-            # Add custom metadata if provided
-            if metadata:
-                base_metadata.update(metadata)
+            results: Dict[str, bool] = {}
+            file_ids: Dict[str, str] = {}
+            for (_, document_id, _, _, _), upload in zip(items, uploads):
+                if isinstance(upload, Exception):
+                    logger.error(
+                        "Error uploading document %s: %s", document_id, str(upload)
+                    )
+                    results[document_id] = False
+                else:
+                    file_ids[document_id] = upload.id
+                    logger.info("Uploaded file to OpenAI with ID: %s", upload.id)
 
-            # Store document metadata
-            self.document_metadata[document_id] = base_metadata
+            if not file_ids:
+                return results
 
-            # Clean up temporary file
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-                logger.debug("Cleaned up temporary file: %s", temp_filepath)
+            # Ensure we have a vector store available
+            vector_store_id: str = await self._ensure_vector_store_exists()
 
-            # Save metadata to disk
-            self._save_metadata()
+            # Add the uploaded files to the vector store by their IDs, so their
+            # bytes are only sent once, and wait for them to be indexed
+            try:
+                file_batch = await self._throttled(
+                    self.client.beta.vector_stores.file_batches.create,
+                    vector_store_id=vector_store_id,
+                    file_ids=list(file_ids.values()),
+                )
+                batch_status = await self._wait_for_file_batch(
+                    vector_store_id, file_batch.id
+                )
 
-            logger.info(
-                "Added %s document chunks to OpenAI vector store with ID %s",
-                len(documents),
-                document_id,
-            )
-            return True
+                # Files can fail to be indexed individually in a batch that
+                # completes
+                failed_file_ids: Set[str] = set()
+                if batch_status.file_counts.failed:
+                    async for (
+                        vector_store_file
+                    ) in self.client.beta.vector_stores.file_batches.list_files(
+                        vector_store_id=vector_store_id,
+                        batch_id=file_batch.id,
+                        filter="failed",
+                    ):
+                        failed_file_ids.add(vector_store_file.id)
+            except Exception as e:
+                logger.error("Error adding files to vector store: %s", str(e))
+                raise e
+
+            # Prepare the metadata of every indexed document
+            rows: List[Tuple[str, str, Any]] = []
+            added: Dict[str, Dict[str, Any]] = {}
+            for documents, document_id, filename, metadata, content_hash in items:
+                file_id: Optional[str] = file_ids.get(document_id)
+                if file_id is None:
+                    continue
+                if file_id in failed_file_ids:
+                    logger.error(
+                        "File %s of document %s failed to be indexed",
+                        file_id,
+                        document_id,
+                    )
+                    results[document_id] = False
+                    continue
+
+                base_metadata: Dict[str, Any] = {
+                    "document_id": document_id,
+                    "filename": filename,
+                    "file_id": file_id,
+                    "vector_store_id": vector_store_id,
+                    "vector_store_name": self._vector_store_names[vector_store_id],
+                    "added_at": datetime.now().isoformat(),  # Use ISO format timestamp
+                    "num_chunks": len(documents),
+                }
+                if content_hash:
+                    base_metadata["content_hash"] = content_hash
+
+                # Add custom metadata if provided
+                if metadata:
+                    base_metadata.update(metadata)
+
+                added[document_id] = base_metadata
+                rows.append(("file_ids", document_id, file_id))
+                rows.append(("metadata", document_id, base_metadata))
+
+            # Save the file ID mappings and document metadata in one
+            # transaction, then store them
+            if rows:
+                self._write_rows(rows)
+                for document_id, base_metadata in added.items():
+                    self.file_ids[document_id] = file_ids[document_id]
+                    self.document_metadata[document_id] = base_metadata
+                    results[document_id] = True
+                    logger.info(
+                        "Added %s document chunks to OpenAI vector store with ID %s",
+                        base_metadata["num_chunks"],
+                        document_id,
+                    )
+                self.version += 1
+
+            return results
 
         except Exception as e:
             logger.error("Error adding documents: %s", str(e))
             raise e
 
+    def find_document_by_hash(self, content_hash: str) -> Optional[str]:
+        """
+        Find a stored document with the given content.
+
+        Args:
+            content_hash (str): SHA-256 hex digest of the file content.
+
+        Returns:
+            Optional[str]: The ID of a document with that content, or None if
+                there is none.
+        """
+        for document_id, document in self.document_metadata.items():
+            if document.get("content_hash") == content_hash:
+                return document_id
+        return None
+
+    def add_document_reference(
+        self,
+        document_id: str,
+        filename: str,
+        source_document_id: str,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Add a document whose content is already stored under another document.
+
+        The new document shares the source document's OpenAI file, so nothing
+        is uploaded or embedded again.
+
+        Args:
+            document_id (str): Unique identifier for the new document.
+            filename (str): Original filename of the new document.
+            source_document_id (str): ID of the stored document with the same content.
+            metadata (Optional[Dict[str, Any]], optional): Additional metadata. Defaults to None.
+
+        Raises:
+            KeyError: If the source document does not exist.
+            sqlite3.Error: If the document cannot be saved.
+        """
+        source: Dict[str, Any] = self.document_metadata[source_document_id]
+
+        base_metadata: Dict[str, Any] = {
+            "document_id": document_id,
+            "filename": filename,
+            "file_id": source["file_id"],
+            "vector_store_id": source["vector_store_id"],
+            "vector_store_name": source["vector_store_name"],
+            "added_at": datetime.now().isoformat(),
+            "num_chunks": source["num_chunks"],
+            "content_hash": source["content_hash"],
+            "duplicate_of": source_document_id,
+        }
+        if metadata:
+            base_metadata.update(metadata)
+
+        self._write_rows(
+            [
+                ("file_ids", document_id, source["file_id"]),
+                ("metadata", document_id, base_metadata),
+            ]
+        )
+        self.document_metadata[document_id] = base_metadata
+        self.file_ids[document_id] = source["file_id"]
+        self.version += 1
+
+        logger.info(
+            "Added document %s as a duplicate of %s", document_id, source_document_id
+        )
+
     def list_documents(self) -> List[Dict[str, Any]]:
         """
         List all documents in the vector store.
 
+        The list is rebuilt only after the documents change, so callers must
+        not modify it.
+
         Returns:
             List[Dict[str, Any]]: A list of document metadata dictionaries.
         """
-        documents: List[Dict[str, Any]] = list(self.document_metadata.values())
+        if self._documents_list_version != self.version:
+            self._documents_list = list(self.document_metadata.values())
+            self._documents_list_version = self.version
+
+        documents: List[Dict[str, Any]] = self._documents_list
         logger.debug("Returning %s documents from vector store", len(documents))
         return documents
 
@@ -386,9 +851,8 @@ class VectorStore:
         Delete a document from the vector store.
 
         This method:
-        1. Removes the file from the vector store
-        2. Deletes the file from OpenAI
-        3. Updates local metadata
+        1. Removes the file from the vector store and deletes it from OpenAI
+        2. Updates local metadata
 
         Args:
             document_id (str): The ID of the document to delete.
@@ -396,52 +860,93 @@ class VectorStore:
         Returns:
             bool: True if the document was deleted successfully, False otherwise.
         """
-        # Check if document exists in our metadata
-        if document_id not in self.document_metadata:
+        # Take the document out of the mappings up front, so a concurrent
+        # deletion of the same document finds nothing to do
+        metadata: Optional[Dict[str, Any]] = self.document_metadata.pop(
+            document_id, None
+        )
+        if metadata is None:
             logger.warning("Document %s not found in metadata", document_id)
             return False
+        file_id: Optional[str] = self.file_ids.pop(document_id, None)
+        self.version += 1
 
         try:
-            # Get file ID and vector store ID
-            file_id: Optional[str] = self.file_ids.get(document_id)
-            vector_store_id: Optional[str] = self.document_metadata[document_id].get(
-                "vector_store_id"
-            )
+            vector_store_id: Optional[str] = metadata.get("vector_store_id")
+
+            # Documents uploaded with the same content share one file, which
+            # is kept until the last of them is deleted
+            file_shared: bool = file_id in self.file_ids.values()
+
+            if file_id and vector_store_id and not file_shared:
+                # Remove the file from the vector store and delete the file
+                # itself from OpenAI concurrently, since neither depends on
+                # the other
+                removed, deleted = await asyncio.gather(
+                    self._throttled(
+                        self.client.beta.vector_stores.files.delete,
+                        vector_store_id=vector_store_id,
+                        file_id=file_id,
+                    ),
+                    self._throttled(self.client.files.delete, file_id=file_id),
+                    return_exceptions=True,
+                )
 
-            if file_id and vector_store_id:
-                # First try to remove the file from the vector store
-                try:
-                    await self.client.beta.vector_stores.files.delete(
-                        vector_store_id=vector_store_id, file_id=file_id
+                if isinstance(removed, Exception):
+                    logger.error(
+                        "Error removing file from vector store: %s", str(removed)
                     )
+                else:
                     logger.info(
                         "Removed file %s from vector store %s", file_id, vector_store_id
                     )
-                except Exception as e:
-                    logger.error("Error removing file from vector store: %s", str(e))
 
-                # Then delete the file itself from OpenAI
-                try:
-                    await self.client.files.delete(file_id=file_id)
+                if isinstance(deleted, Exception):
+                    logger.error("Error deleting file from OpenAI: %s", str(deleted))
+                else:
                     logger.info("Deleted file %s from OpenAI", file_id)
-                except Exception as e:
-                    logger.error("Error deleting file from OpenAI: %s", str(e))
 
-            # Remove from metadata and file IDs mappings
-            del self.document_metadata[document_id]
-            if document_id in self.file_ids:
-                del self.file_ids[document_id]
-
-            # Save changes to disk
-            self._save_metadata()
+            # Remove from the database
+            self._write_rows(
+                [("metadata", document_id, None), ("file_ids", document_id, None)]
+            )
 
             logger.info("Deleted document with ID %s", document_id)
             return True
 
         except Exception as e:
             logger.error("Error deleting document %s: %s", document_id, str(e))
+
+            # Put the document back, since it is still in the database
+            self.document_metadata[document_id] = metadata
+            if file_id is not None:
+                self.file_ids[document_id] = file_id
+            self.version += 1
             return False
 
+    async def delete_documents(self, document_ids: List[str]) -> Dict[str, bool]:
+        """
+        Delete several documents from the vector store concurrently.
+
+        At most MAX_CONCURRENT_DELETES documents are deleted at once.
+
+        Args:
+            document_ids (List[str]): The IDs of the documents to delete.
+
+        Returns:
+            Dict[str, bool]: Whether each document was deleted, keyed by its ID.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_DELETES)
+
+        async def delete(document_id: str) -> bool:
+            async with semaphore:
+                return await self.delete_document(document_id)
+
+        results: List[bool] = await asyncio.gather(
+            *(delete(document_id) for document_id in document_ids)
+        )
+        return dict(zip(document_ids, results))
+
     def get_vector_store_ids(self) -> List[str]:
         """
         Get list of available vector store IDs.
@@ -473,31 +978,43 @@ class VectorStore:
         try:
             result: Dict[str, Any] = {"status": "ok", "vector_stores": {}}
 
-            # Gather information about each vector store
-            for name, vs_id in self.vector_stores.items():
-                try:
-                    # Retrieve vector store information from OpenAI
-                    vector_store = await self.client.beta.vector_stores.retrieve(
-                        vector_store_id=vs_id
+            # Retrieve every vector store from OpenAI concurrently
+            stores: List[Tuple[str, str]] = list(self.vector_stores.items())
+            responses: List[Any] = await asyncio.gather(
+                *(
+                    self._throttled(
+                        self.client.beta.vector_stores.retrieve, vector_store_id=vs_id
                     )
+                    for _, vs_id in stores
+                ),
+                return_exceptions=True,
+            )
 
-                    # Extract relevant information
+            # Gather information about each vector store
+            for (name, vs_id), vector_store in zip(stores, responses):
+                if isinstance(vector_store, Exception):
+                    # Record errors for individual vector stores
+                    logger.error(
+                        "Error retrieving vector store %s: %s", vs_id, str(vector_store)
+                    )
                     result["vector_stores"][name] = {
                         "id": vs_id,
-                        "name": vector_store.name,
-                        "status": vector_store.status,
-                        "file_counts": (
-                            vector_store.file_counts
-                            if hasattr(vector_store, "file_counts")
-                            else None
-                        ),
-                        "created_at": vector_store.created_at,
+                        "error": str(vector_store),
                     }
-
-                except Exception as e:
-                    # Record errors for individual vector stores
-                    logger.error("Error retrieving vector store %s: %s", vs_id, str(e))
-                    result["vector_stores"][name] = {"id": vs_id, "error": str(e)}
+                    continue
+
+                # Extract relevant information
+                result["vector_stores"][name] = {
+                    "id": vs_id,
+                    "name": vector_store.name,
+                    "status": vector_store.status,
+                    "file_counts": (
+                        vector_store.file_counts
+                        if hasattr(vector_store, "file_counts")
+                        else None
+                    ),
+                    "created_at": vector_store.created_at,
+                }
 
             return result
 
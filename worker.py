@@ -0,0 +1,84 @@
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from arq.connections import RedisSettings
+from dotenv import load_dotenv
+
+from clients import close_clients
+from utils import process_file, shutdown_pdf_pool
+from vector_store import VectorStore
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging for the worker module
+logger = logging.getLogger(__name__)
+
+
+async def startup(ctx: Dict[str, Any]) -> None:
+    """
+    Load the vector store once for every job the worker runs.
+
+    Args:
+        ctx (Dict[str, Any]): The worker context shared by all jobs.
+    """
+    ctx["vector_store"] = VectorStore()
+
+
+async def shutdown(ctx: Dict[str, Any]) -> None:
+    """
+    Close the vector store database, the shared HTTP connection pool and the
+    PDF parsing pool when the worker stops.
+
+    Args:
+        ctx (Dict[str, Any]): The worker context shared by all jobs.
+    """
+    ctx["vector_store"].close()
+    await close_clients()
+    shutdown_pdf_pool()
+
+
+async def ingest(
+    ctx: Dict[str, Any],
+    file_path: str,
+    filename: str,
+    document_id: str,
+    metadata: Dict[str, Any],
+    content_hash: Optional[str] = None,
+) -> None:
+    """
+    Process an uploaded file and add it to the vector store.
+
+    Args:
+        ctx (Dict[str, Any]): The worker context shared by all jobs.
+        file_path (str): The path of the uploaded file's temporary copy.
+        filename (str): The name of the file.
+        document_id (str): A unique identifier for the document.
+        metadata (Dict[str, Any]): Additional metadata to store with the document.
+        content_hash (Optional[str], optional): SHA-256 hex digest of the file
+            content. Defaults to None.
+    """
+    vector_store: VectorStore = ctx["vector_store"]
+
+    # Pick up documents the API deleted since the last job
+    vector_store.reload_if_changed()
+
+    await process_file(
+        file_path, filename, document_id, metadata, vector_store, content_hash
+    )
+
+
+class WorkerSettings:
+    """
+    Settings for the document ingestion worker, run with
+    `arq worker.WorkerSettings`.
+    """
+
+    functions = [ingest]
+    on_startup = startup
+    on_shutdown = shutdown
+    redis_settings = RedisSettings.from_dsn(
+        os.getenv("REDIS_URL", "redis://localhost:6379")
+    )
+    max_jobs = int(os.getenv("INGEST_MAX_JOBS", "4"))